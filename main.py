@@ -1,72 +1,81 @@
 import logging
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 import os
 import sys, traceback
 import json
-import yaml
 import time
-from rasterio._env import get_gdal_data
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from time import perf_counter
 from datetime import datetime
-from shapely.geometry import box, mapping  
-from src.extract.download_landsat_stac import download_landsat_scenes
-from src.transform.compute_ndvi import compute_ndvi, clip_raster_to_aoi
-from src.load.load_to_postgis import run_loader
+from src.config import load_settings, get_aoi_geom_wgs84
+from src.extract.download_landsat_stac import iter_landsat_scenes
+
+try:
+    import orjson  ##optional, faster GeoJSON writes
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
 
 ##log directory
 LOG_DIR = os.path.join(os.path.dirname(__file__), "logs")
-os.makedirs(LOG_DIR, exist_ok=True)
-
-##timestamp log file
-log_filename = f"pipeline_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-log_path = os.path.join(LOG_DIR, log_filename)
-
-##logger
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    handlers=[
-        logging.FileHandler(log_path, encoding="utf-8"),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
-logger = logging.getLogger(__name__)
 
 
-try:
-    from pyproj import datadir
-    os.environ.pop("PROJ_LIB", None)
-    os.environ.pop("PROJ_DATA", None)
-    proj_dir = datadir.get_data_dir()
-    os.environ["PROJ_LIB"] = proj_dir
-    os.environ["PROJ_DATA"] = proj_dir
-    try:  
-        gdal_data = get_gdal_data()
-        if gdal_data:
-            os.environ["GDAL_DATA"] = gdal_data
-    except Exception:
-        pass
-    os.environ.setdefault("PROJ_NETWORK", "ON")
-    logger.info(f"PROJ set to: {proj_dir}")
-except Exception as e:
-    logger.error(f"Could not set PROJ paths: {e}")
-
-##get settings 
-def load_settings():
-    here = os.path.dirname(os.path.abspath(__file__))         
-    root = os.path.dirname(here)                                
-    candidates = [
-        os.path.join(here, "config", "settings.yaml"),         
-        os.path.join(root, "config", "settings.yaml"),          
-    ]
-    for cfg in candidates:
-        if os.path.exists(cfg):
-            with open(cfg, "r", encoding="utf-8-sig") as f:
-                return yaml.safe_load(f), cfg
-    raise FileNotFoundError("settings.yaml not found in:\n  - " + "\n  - ".join(candidates))
+def _setup_logging():
+    """
+    Timestamped, size-capped log file plus stdout. Called once from the entry
+    point only: transform workers re-import this module and must not open
+    (and rotate) their own copy of the file; they log through a queue instead.
+    """
+    os.makedirs(LOG_DIR, exist_ok=True)
+    log_filename = f"pipeline_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
+    log_path = os.path.join(LOG_DIR, log_filename)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+        handlers=[
+            ##cap log growth on long runs: 50 MB x 3 backups
+            RotatingFileHandler(log_path, maxBytes=50 * 2**20, backupCount=3, encoding="utf-8"),
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+    return log_path
 
 
+def _setup_env():
+    """PROJ/GDAL paths and remote-read options; set once in the parent, workers inherit them."""
+    try:
+        from pyproj import datadir
+        os.environ.pop("PROJ_LIB", None)
+        os.environ.pop("PROJ_DATA", None)
+        proj_dir = datadir.get_data_dir()
+        os.environ["PROJ_LIB"] = proj_dir
+        os.environ["PROJ_DATA"] = proj_dir
+        try:  
+            from rasterio._env import get_gdal_data
+            gdal_data = get_gdal_data()
+            if gdal_data:
+                os.environ["GDAL_DATA"] = gdal_data
+        except Exception:
+            pass
+        os.environ.setdefault("PROJ_NETWORK", "ON")
+        ##remote COG reads (download.mode: vsicurl)
+        os.environ.setdefault("GDAL_HTTP_MULTIPLEX", "YES")
+        os.environ.setdefault("GDAL_HTTP_VERSION", "2")
+        os.environ.setdefault("CPL_VSIL_CURL_ALLOWED_EXTENSIONS", ".tif,.TIF")
+        os.environ.setdefault("CPL_VSIL_CURL_USE_HEAD", "NO")
+        os.environ.setdefault("GDAL_DISABLE_READDIR_ON_OPEN", "EMPTY_DIR")
+        os.environ.setdefault("VSI_CACHE", "TRUE")
+        os.environ.setdefault("VSI_CACHE_SIZE", "536870912")
+        logger.info(f"PROJ set to: {proj_dir}")
+    except Exception as e:
+        logger.error(f"Could not set PROJ paths: {e}")
+
 def ensure_aoi_geojson_from_bbox(bbox, aoi_path):
     """Create a GeoJSON bbox polygon at aoi_path if it doesn't exist. Returns absolute path."""
+    from shapely.geometry import box, mapping
     here = os.path.dirname(os.path.abspath(__file__))
     aoi_abs = aoi_path if os.path.isabs(aoi_path) else os.path.join(here, aoi_path)
     os.makedirs(os.path.dirname(aoi_abs), exist_ok=True)
@@ -82,8 +91,12 @@ def ensure_aoi_geojson_from_bbox(bbox, aoi_path):
                 "properties": {"name": "AOI", "crs": "EPSG:4326"}
             }]
         }
-        with open(aoi_abs, "w", encoding="utf-8") as f:
-            json.dump(fc, f)
+        if orjson is not None:
+            with open(aoi_abs, "wb") as f:
+                f.write(orjson.dumps(fc, option=orjson.OPT_SERIALIZE_NUMPY))
+        else:
+            with open(aoi_abs, "w", encoding="utf-8") as f:
+                json.dump(fc, f)
         logger.info(f"Created AOI GeoJSON at {aoi_abs}")
     else:
         logger.info(f"Using existing AOI GeoJSON at {aoi_abs}")
@@ -91,58 +104,145 @@ def ensure_aoi_geojson_from_bbox(bbox, aoi_path):
     return aoi_abs
 
 
+def _apply_perf_env(config):
+    perf = config.get("perf", {}) or {}
+    ##opt-in mmap reads: GDAL maps local rasters instead of a pread per block.
+    ##Only uncompressed, untiled-friendly files that fit in RAM benefit; compressed
+    ##GeoTIFFs (our NDVI/clip outputs) keep the normal block reader.
+    if perf.get("mmap_reads"):
+        os.environ.setdefault("GDAL_VIRTUAL_MEM_IO", "IF_ENOUGH_RAM")
+        os.environ["CPL_VSIL_USE_TEMP_FILE_FOR_RANDOM_WRITE"] = "YES"
+        logger.info("GDAL mmap reads enabled (GDAL_VIRTUAL_MEM_IO=IF_ENOUGH_RAM)")
+
+
+def _init_transform_worker(warp_threads=1, log_queue=None):
+    ##records go back to the parent's handlers, so the run keeps a single log file
+    if log_queue is not None:
+        root = logging.getLogger()
+        root.handlers[:] = [QueueHandler(log_queue)]
+        root.setLevel(logging.INFO)
+    ##each worker process gets its own GDAL block cache; keep it bounded
+    os.environ["GDAL_CACHEMAX"] = "512"
+    ##split the cores between workers instead of every warp grabbing all of them
+    os.environ["GDAL_NUM_THREADS"] = str(warp_threads)
+    os.environ["NUMEXPR_NUM_THREADS"] = str(warp_threads)
+
+
+def _process_scene(s, aoi_path, out_dir, aoi_wgs84=None, zarr_path=None):
+    """Returns the clipped raster path, or None when the scene misses the AOI."""
+    from shapely.geometry import box
+    from src.transform.compute_ndvi import compute_ndvi, clip_raster_to_aoi, link_as_clipped, write_ndvi_zarr
+    scene_id = s.get("scene_id", "unknown")
+    b4_path = s['B4']
+    b5_path = s['B5']
+
+    ##STAC footprint vs AOI: skip disjoint scenes, skip clip when fully inside
+    scene_box = box(*s["bbox"]) if s.get("bbox") and aoi_wgs84 is not None else None
+    if scene_box is not None and not aoi_wgs84.intersects(scene_box):
+        logger.warning(f"Scene footprint misses AOI, skipping: {scene_id}")
+        return None
+
+    ndvi_output = os.path.join(out_dir, f"{scene_id}_NDVI.tif")
+    clipped_output = os.path.join(out_dir, f"{scene_id}_NDVI_clipped.tif")
+
+    logger.info(f"Computing NDVI for {scene_id} ...")
+    compute_ndvi(b4_path, b5_path, ndvi_output)
+
+    if scene_box is not None and aoi_wgs84.contains(scene_box):
+        link_as_clipped(ndvi_output, clipped_output)
+    else:
+        logger.info(f"Clipping NDVI to AOI for {scene_id} ...")
+        clip_raster_to_aoi(ndvi_output, aoi_path, clipped_output)
+
+    if zarr_path:
+        write_ndvi_zarr(clipped_output, zarr_path, scene_id)
+
+    logger.info(f"Done: {clipped_output}")
+    return clipped_output
+
+
 def run_pipeline():
+    from shapely.geometry import shape
+    from src.load.load_to_postgis import run_loader
+
     ##load config
     config, CONFIG_PATH = load_settings()
     logger.info(f"Using config: {CONFIG_PATH}")
+    _apply_perf_env(config)
 
     ##check if AOI file exists
     AOI_PATH = ensure_aoi_geojson_from_bbox(config['aoi']['bbox'], config['aoi']['geojson_path'])
+    aoi_wgs84 = shape(get_aoi_geom_wgs84(AOI_PATH))
 
     here = os.path.dirname(os.path.abspath(__file__))
     PROCESSED_DIR = os.path.join(here, "data", "processed")
     os.makedirs(PROCESSED_DIR, exist_ok=True)
 
-    scenes = download_landsat_scenes()
+    ##optional chunked Zarr copy of every clipped NDVI
+    zarr_path = (config.get("products", {}) or {}).get("zarr_path")
+    if zarr_path:
+        from src.transform.compute_ndvi import init_ndvi_zarr
+        init_ndvi_zarr(zarr_path)
 
-    if not scenes:
-        print("No scenes downloaded.")
-        return
+    transform_opts = config.get("transform", {}) or {}
+    workers = int(transform_opts.get("workers") or os.cpu_count() or 1)
+    max_in_flight = int(transform_opts.get("max_in_flight", 2 * workers))
 
     start = perf_counter()
 
     success_count = 0
+    skipped_count = 0
     failure_count = 0
     failures = []
 
-    for s in scenes:
-        scene_id = s.get("scene_id", "unknown")
-        try:
-            b4_path = s['B4']
-            b5_path = s['B5']
-
-            ndvi_output = os.path.join(PROCESSED_DIR, f"{scene_id}_NDVI.tif")
-            clipped_output = os.path.join(PROCESSED_DIR, f"{scene_id}_NDVI_clipped.tif")
-
-            logger.info(f"Computing NDVI for {scene_id} ...")
-            compute_ndvi(b4_path, b5_path, ndvi_output)
-
-            logger.info(f"Clipping NDVI to AOI for {scene_id} ...")
-            clip_raster_to_aoi(ndvi_output, AOI_PATH, clipped_output)
+    ##NDVI+clip runs in worker processes while later scenes are still downloading;
+    ##the semaphore caps scenes queued/in progress, and while it is full the scene
+    ##generator isn't pulled, so downloads can't run more than a window ahead.
+    ##Bands and outputs stay on disk, so this caps work in flight, not disk use
+    in_flight = threading.Semaphore(max_in_flight)
+    futs = {}
+    warp_threads = max(1, (os.cpu_count() or 1) // workers)
+    ##workers start lazily, after the download threads are up; forking then can copy
+    ##a lock held by one of them, so start them from a clean forkserver where available
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    mp_context = multiprocessing.get_context(start_method)
+    log_queue = mp_context.Queue()
+    log_listener = QueueListener(log_queue, *logging.getLogger().handlers, respect_handler_level=True)
+    log_listener.start()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_transform_worker,
+                                 initargs=(warp_threads, log_queue), mp_context=mp_context) as ex:
+            for s in iter_landsat_scenes():
+                in_flight.acquire()
+                fut = ex.submit(_process_scene, s, AOI_PATH, PROCESSED_DIR, aoi_wgs84, zarr_path)
+                fut.add_done_callback(lambda _f: in_flight.release())
+                futs[fut] = s.get("scene_id", "unknown")
 
-            logger.info(f"Done: {clipped_output}")
-            success_count += 1
+            for fut in as_completed(futs):
+                scene_id = futs[fut]
+                try:
+                    if fut.result() is None:
+                        skipped_count += 1
+                    else:
+                        success_count += 1
+                except Exception as e:
+                    logger.error(f"Failed on {scene_id}: {e}")
+                    failures.append((scene_id, str(e)))
+                    failure_count += 1
+    finally:
+        log_listener.stop()
 
-        except Exception as e:
-            logger.error(f"Failed on {scene_id}: {e}")
-            failures.append((scene_id, str(e)))
-            failure_count += 1
+    scenes = list(futs.values())
+    if not scenes:
+        print("No scenes downloaded.")
+        return
 
     duration = perf_counter() - start
 
     logger.info("\nPipeline Summary:")
     logger.info(f"  - Total scenes    : {len(scenes)}")
     logger.info(f"  - Successful      : {success_count}")
+    logger.info(f"  - Outside AOI     : {skipped_count}")
     logger.info(f"  - Failed          : {failure_count}")
     logger.info(f"  - Duration        : {duration:.2f} seconds")
 
@@ -155,10 +255,12 @@ def run_pipeline():
     logger.info("Loading processed results into PostGIS...")
 
     ##load to postgis db
-    run_loader() 
+    run_loader(config.get("load")) 
 
 
 if __name__ == "__main__":
+    _setup_logging()
+    _setup_env()
     logger.info(f">>> Python: {sys.executable}")
     logger.info(f">>> Entry: {__file__}")
     try:
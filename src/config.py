@@ -0,0 +1,60 @@
+from typing import Optional, Tuple
+from functools import lru_cache
+import os, yaml
+
+##single settings.yaml loader shared by main.py and the src modules
+@lru_cache(maxsize=1)
+def load_settings() -> Tuple[dict, str]:
+    here = os.path.dirname(os.path.abspath(__file__))
+    root = os.path.dirname(here)
+    candidates = [
+        os.path.join(root, "config", "settings.yaml"),
+        os.path.join(os.path.dirname(root), "config", "settings.yaml"),
+    ]
+    for cfg in candidates:
+        if os.path.exists(cfg):
+            with open(cfg, "r", encoding="utf-8-sig") as f:
+                return yaml.safe_load(f) or {}, cfg
+    raise FileNotFoundError("settings.yaml not found in:\n  - " + "\n  - ".join(candidates))
+
+def get_settings() -> dict:
+    return load_settings()[0]
+
+@lru_cache(maxsize=8)
+def _read_aoi_cached(path: str, mtime: float):
+    import geopandas as gpd
+    return gpd.read_file(path)
+
+def read_aoi(path):
+    """AOI GeoDataFrame, parsed once per (path, mtime). Shared: don't modify in place."""
+    return _read_aoi_cached(str(path), os.path.getmtime(path))
+
+def aoi_mtime(aoi_path: Optional[str]) -> Optional[float]:
+    """mtime of the AOI file, or None if unset/missing; use it in cache keys built on the AOI."""
+    if aoi_path and os.path.exists(aoi_path):
+        return os.path.getmtime(aoi_path)
+    return None
+
+def get_aoi_geom_wgs84(aoi_path: Optional[str], bbox: Optional[Tuple[float, ...]] = None):
+    """AOI as a GeoJSON-like mapping in EPSG:4326, from the file if present else the bbox."""
+    return _aoi_geom_wgs84_cached(aoi_path, bbox, aoi_mtime(aoi_path))
+
+##keyed on mtime too, so an edited AOI file is picked up without a restart
+@lru_cache(maxsize=4)
+def _aoi_geom_wgs84_cached(aoi_path: Optional[str], bbox: Optional[Tuple[float, ...]], mtime: Optional[float]):
+    ##heavy geo stack imported on first use only
+    from shapely.geometry import box, mapping
+    if aoi_path and os.path.exists(aoi_path):
+        gdf = read_aoi(aoi_path)
+        if gdf.crs is None:
+            ##assuming WGS84 if missing
+            gdf = gdf.set_crs("EPSG:4326")
+        if gdf.crs.to_epsg() != 4326:
+            gdf = gdf.to_crs(4326)
+        ##single bbox feature is the common case; skip the union
+        geom = gdf.geometry.iloc[0] if len(gdf) == 1 else gdf.geometry.unary_union
+        return mapping(geom)
+    if bbox:
+        minlon, minlat, maxlon, maxlat = bbox
+        return mapping(box(minlon, minlat, maxlon, maxlat))
+    return None
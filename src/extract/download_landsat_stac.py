@@ -1,46 +1,63 @@
 from typing import Dict, Any, Optional, Tuple, List
-import os, math, yaml, json, requests
-from shapely.geometry import box, mapping
-import geopandas as gpd
+import os, math, json, threading, time
+from collections import OrderedDict
+from functools import lru_cache
+import urllib3
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import logging
-from pystac_client import Client
-import planetary_computer as pc  
+from src.config import get_settings, get_aoi_geom_wgs84, aoi_mtime
 
 logger = logging.getLogger(__name__)
 
-##config loader
-def load_settings() -> Tuple[dict, str]:
-    here = os.path.dirname(os.path.abspath(__file__))             
-    pipe_root = os.path.dirname(here)                              
-    proj_root = os.path.dirname(pipe_root)                         
-    candidates = [
-        os.path.join(pipe_root, "config", "settings.yaml"),
-        os.path.join(proj_root, "config", "settings.yaml"),
-    ]
-    for cfg in candidates:
-        if os.path.exists(cfg):
-            with open(cfg, "r", encoding="utf-8-sig") as f:
-                return yaml.safe_load(f), cfg
-    raise FileNotFoundError("settings.yaml not found in:\n  - " + "\n  - ".join(candidates))
-
-config, _ = load_settings() 
-
-AOI_BBOX = config["aoi"]["bbox"]
-AOI_PATH = config["aoi"]["geojson_path"]
-START_DATE = config["dates"]["start"]
-END_DATE = config["dates"]["end"]
-OUTPUT_DIR = config["download"]["output_dir"]
-MAX_CLOUD_COVER = config["download"].get("max_cloud_cover", None)
-MAX_ITEMS = config["download"].get("max_items", None)
-
-STAC_ENDPOINT = config["stac"]["endpoint"]         
-STAC_COLLECTION = config["stac"]["collection"]     
-
-USE_INTERSECTS = bool(config.get("search", {}).get("use_intersects", True))
-
-BBOX_PAD_KM = config.get("aoi", {}).get("bbox_pad_km", 0)
+MIN_TIF_BYTES = 1_000_000
+MIN_RANGED_BYTES = 8 * 1024 * 1024
+CHUNK_SIZE = 8 * 1024 * 1024
+
+##asset keys, lowercase: prefer human-friendly keys; fall back to SR_B# variants
+RED_KEYS = ("red", "sr_b3", "sr_b4", "b3", "b4", "b03", "b04")
+NIR_KEYS = ("nir08", "sr_b4", "sr_b5", "b4", "b5", "b04", "b05")
+
+##SAS tokens are valid ~1h; re-sign well before that
+SIGN_TTL_S = 45 * 60
 
 ##helpers 
+@lru_cache(maxsize=1)
+def _stac(endpoint: str):
+    """One STAC client per process; skips the root-doc GET on repeat runs."""
+    from pystac_client import Client
+    return Client.open(endpoint)
+
+##(item id, self href) -> (signed_at, signed item); a plain lru_cache would
+##hand out expired tokens, so entries carry their signing time. Kept in LRU
+##order and capped like lru_cache(maxsize=SIGNED_MAX) for long-running workers
+SIGNED_MAX = 4096
+_SIGNED: "OrderedDict[Tuple[str, Optional[str]], Tuple[float, Any]]" = OrderedDict()
+_SIGNED_LOCK = threading.Lock()
+
+def _signed(item):
+    import planetary_computer as pc
+    key = (item.id, item.get_self_href())
+    now = time.monotonic()
+    with _SIGNED_LOCK:
+        hit = _SIGNED.get(key)
+        if hit and now - hit[0] < SIGN_TTL_S:
+            _SIGNED.move_to_end(key)
+            return hit[1]
+    sitem = pc.sign(item)  ##add SAS tokens
+    with _SIGNED_LOCK:
+        _SIGNED[key] = (now, sitem)
+        _SIGNED.move_to_end(key)
+        while len(_SIGNED) > SIGNED_MAX:
+            _SIGNED.popitem(last=False)
+    return sitem
+
+def _forget_signed(scene_id: str):
+    """Drop a scene's signature, e.g. after a 403, so the next run re-signs it."""
+    with _SIGNED_LOCK:
+        for key in [k for k in _SIGNED if k[0] == scene_id]:
+            del _SIGNED[key]
+
 def pad_bbox_km(bbox, pad_km=0):
     if not pad_km or pad_km <= 0:
         return bbox
@@ -50,69 +67,238 @@ def pad_bbox_km(bbox, pad_km=0):
     dlon = pad_km / (111.320 * max(0.01, math.cos(math.radians(mean_lat))))
     return (minlon - dlon, minlat - dlat, maxlon + dlon, maxlat + dlat)
 
-def _is_geotiff_header(headers: Dict[str, str]) -> bool:
-    ctype = (headers.get("Content-Type") or "").lower()
-    return ("tiff" in ctype) or ("geotiff" in ctype) or ("image/tif" in ctype)
+##classic TIFF (II*\0 / MM\0*) and BigTIFF (II+\0 / MM\0+) signatures
+TIFF_MAGICS = (b"II*\x00", b"MM\x00*", b"II+\x00", b"MM\x00+")
+
+def _is_tiff_magic(first: bytes) -> bool:
+    return first[:4] in TIFF_MAGICS
 
 def _ensure_big_tif(path: str):
     if not os.path.exists(path):
         raise FileNotFoundError(path)
     size = os.path.getsize(path)
-    if size < 1_000_000:
+    if size < MIN_TIF_BYTES:
         raise ValueError(f"Downloaded file too small: {path} ({size} bytes)")
 
-def _pick(assets: Dict[str, Any], names: List[str]) -> Optional[Any]:
-    lower = {k.lower(): k for k in assets.keys()}
+def _pick(assets: Dict[str, Any], names: Tuple[str, ...], lower: Optional[Dict[str, str]] = None) -> Optional[Any]:
+    ##names must be lowercase; pass lower to reuse one key map across picks
+    if lower is None:
+        lower = {k.lower(): k for k in assets}
     for want in names:
-        k = lower.get(want.lower())
+        k = lower.get(want)
         if k:
             return assets[k]
     return None
 
-def _read_aoi_geom_wgs84(aoi_path: Optional[str], bbox: Optional[List[float]]):
-    if aoi_path and os.path.exists(aoi_path):
-        gdf = gpd.read_file(aoi_path)
-        if gdf.crs is None:
-            ##assuming WGS84 if missing
-            gdf = gdf.set_crs("EPSG:4326")  
-        gdf = gdf.to_crs(4326)
-        geom = gdf.geometry.unary_union
-        return mapping(geom)
-    if bbox:
-        minlon, minlat, maxlon, maxlat = bbox
-        return mapping(box(minlon, minlat, maxlon, maxlat))
-    return None
+def _make_pool(pool_size: int) -> urllib3.PoolManager:
+    return urllib3.PoolManager(
+        num_pools=4,
+        maxsize=pool_size,
+        retries=Retry(3, backoff_factor=0.5),
+        timeout=urllib3.Timeout(connect=30, read=240),
+    )
+
+def _raise_for_status(r, url: str):
+    if r.status >= 400:
+        raise IOError(f"HTTP {r.status} for {url.split('?')[0]}")
+
+def _pwrite_all(fd: int, data: bytes, offset: int):
+    view = memoryview(data)
+    while view:
+        n = os.pwrite(fd, view, offset)
+        view, offset = view[n:], offset + n
+
+def _write_all(f, data: bytes):
+    view = memoryview(data)
+    while view:
+        view = view[f.write(view):]
+
+def _drop_page_cache(path: str):
+    ##finished bands are not re-read here; keep them from evicting warmer pages
+    if not hasattr(os, "posix_fadvise"):
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, os.path.getsize(path), os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+def _split_ranges(size: int, parts: int) -> List[Tuple[int, int]]:
+    step = -(-size // parts)
+    return [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+
+def _fetch_range(http: urllib3.PoolManager, url: str, fd: int, start: int, end: int, abort: threading.Event):
+    ##any failed part dooms the whole file; stop the sibling ranges too
+    try:
+        _fetch_range_into(http, url, fd, start, end, abort)
+    except Exception:
+        abort.set()
+        raise
+
+def _fetch_range_into(http: urllib3.PoolManager, url: str, fd: int, start: int, end: int, abort: threading.Event):
+    r = http.request("GET", url, headers={"Range": f"bytes={start}-{end}"}, preload_content=False)
+    try:
+        _raise_for_status(r, url)
+        if r.status != 206:
+            raise ValueError(f"Range request not honored (HTTP {r.status})")
+        offset = start
+        while not abort.is_set():
+            chunk = r.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            ##the first range carries the file signature; stop every part if it is not a TIFF
+            if offset == 0 and not _is_tiff_magic(chunk):
+                raise ValueError(f"Non-TIFF response at: {url}")
+            _pwrite_all(fd, chunk, offset)
+            offset += len(chunk)
+    finally:
+        r.release_conn()
+    if abort.is_set():
+        return
+    if offset != end + 1:
+        raise IOError(f"Short read for bytes {start}-{end}: got {offset - start} bytes")
+
+def _download_ranged(http: urllib3.PoolManager, url: str, dst: str, size: int, parts: int):
+    fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    done = False
+    try:
+        os.ftruncate(fd, size)
+        ranges = _split_ranges(size, parts)
+        abort = threading.Event()
+        with ThreadPoolExecutor(max_workers=len(ranges)) as ex:
+            futs = [ex.submit(_fetch_range, http, url, fd, start, end, abort) for start, end in ranges]
+            for fut in futs:
+                fut.result()
+        done = True
+    finally:
+        os.close(fd)
+        ##never leave a pre-sized, partly written file behind
+        if not done:
+            try: os.remove(dst)
+            except OSError: pass
+
+def _is_complete_local(dst: str, expected_size: int) -> bool:
+    if expected_size <= 0 or os.path.getsize(dst) != expected_size:
+        return False
+    with open(dst, "rb") as f:
+        return _is_tiff_magic(f.read(4))
+
+def _download_asset(http: urllib3.PoolManager, asset_href: str, dst: str, parts: int = 1) -> bool:
+    ##bytes land in dst.part and are renamed only once complete, so a crash never leaves a "cached" dst
+    part = dst + ".part"
+    try:
+        h = None
+        ##resume: keep a band already on disk when it matches the remote size
+        if os.path.exists(dst) and os.path.getsize(dst) >= MIN_TIF_BYTES:
+            h = http.request("HEAD", asset_href)
+            _raise_for_status(h, asset_href)
+            if _is_complete_local(dst, int(h.headers.get("Content-Length") or 0)):
+                logger.info("cached: %s", dst)
+                return True
+        logger.debug("%s <- %s", os.path.basename(dst), asset_href)
+        ##large files are split into byte ranges fetched over parallel connections
+        if parts > 1 and hasattr(os, "pwrite"):
+            if h is None:
+                h = http.request("HEAD", asset_href)
+                _raise_for_status(h, asset_href)
+            size = int(h.headers.get("Content-Length") or 0)
+            ranged = h.headers.get("Accept-Ranges", "").lower() == "bytes" and size >= MIN_RANGED_BYTES
+            if ranged:
+                _download_ranged(http, asset_href, part, size, parts)
+                _ensure_big_tif(part)
+                os.replace(part, dst)
+                _drop_page_cache(dst)
+                logger.info("%.1f MB -> %s (%d parts)", os.path.getsize(dst) / 1e6, dst, parts)
+                return True
+        r = http.request("GET", asset_href, preload_content=False)
+        try:
+            _raise_for_status(r, asset_href)
+            ##check the TIFF signature before anything touches disk
+            first = r.read(65536) or b""
+            if not _is_tiff_magic(first):
+                sample = first[:1200].decode("utf-8", "ignore")
+                logger.warning("Non-TIFF response at: %s", asset_href)
+                logger.debug("Sample:\n%r", sample[:200])
+                return False
+            ##unbuffered file: each 8 MiB chunk goes straight to write(2)
+            with open(part, "wb", buffering=0) as f:
+                _write_all(f, first)
+                while True:
+                    chunk = r.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    _write_all(f, chunk)
+        finally:
+            r.release_conn()
+        _ensure_big_tif(part)
+        os.replace(part, dst)
+        _drop_page_cache(dst)
+        logger.info("%.1f MB -> %s", os.path.getsize(dst) / 1e6, dst)
+        return True
+    except Exception as e:
+        logger.error("Failed to download %s: %s", os.path.basename(dst), e)
+        try: os.remove(part)
+        except OSError: pass
+        return False
 
 ##download images
-def download_landsat_scenes():
+@lru_cache(maxsize=16)
+def _build_search_kwargs(collection, aoi_path, aoi_file_mtime, aoi_bbox, start, end, max_cloud, use_intersects, pad_km):
+    """STAC search kwargs as a tuple of items; repeat runs in one worker reuse it until the AOI file changes."""
     ##build spatial filter
-    aoi_geom = _read_aoi_geom_wgs84(AOI_PATH, AOI_BBOX)
+    aoi_geom = get_aoi_geom_wgs84(aoi_path, aoi_bbox)
     if aoi_geom is None:
         raise ValueError("No AOI provided. Set aoi.geojson_path or aoi.bbox in settings.yaml")
 
-    ##search MPC STAC 
-    logger.info(f"STAC query -> collection: {STAC_COLLECTION}, "
-          f"dates: {START_DATE}/{END_DATE}, clouds <= {MAX_CLOUD_COVER if MAX_CLOUD_COVER is not None else 'ANY'}")
-    cat = Client.open(STAC_ENDPOINT)
-
     query = {}
-    if MAX_CLOUD_COVER is not None:
-        query["eo:cloud_cover"] = {"lte": MAX_CLOUD_COVER}
+    if max_cloud is not None:
+        query["eo:cloud_cover"] = {"lte": max_cloud}
 
     search_kwargs = dict(
-        collections=[STAC_COLLECTION],
-        datetime=f"{START_DATE}/{END_DATE}",
+        collections=[collection],
+        datetime=f"{start}/{end}",
         query=query or None,
         limit=200
     )
-    if USE_INTERSECTS:
+    if use_intersects:
         search_kwargs["intersects"] = aoi_geom
     else:
         ##fallback to bbox if intersects disabled
-        minlon, minlat, maxlon, maxlat = AOI_BBOX or [19.0, 59.6, 31.6, 70.2]
-        minlon, minlat, maxlon, maxlat = pad_bbox_km([minlon, minlat, maxlon, maxlat], BBOX_PAD_KM)
+        minlon, minlat, maxlon, maxlat = aoi_bbox or [19.0, 59.6, 31.6, 70.2]
+        minlon, minlat, maxlon, maxlat = pad_bbox_km([minlon, minlat, maxlon, maxlat], pad_km)
         search_kwargs["bbox"] = (minlon, minlat, maxlon, maxlat)
+    return tuple(search_kwargs.items())
+
+def iter_landsat_scenes():
+    """Yield scene dicts as soon as both of a scene's bands are on disk."""
+    config = get_settings()
+    AOI_BBOX = config["aoi"]["bbox"]
+    AOI_PATH = config["aoi"]["geojson_path"]
+    START_DATE = config["dates"]["start"]
+    END_DATE = config["dates"]["end"]
+    OUTPUT_DIR = config["download"]["output_dir"]
+    MAX_CLOUD_COVER = config["download"].get("max_cloud_cover", None)
+    MAX_ITEMS = config["download"].get("max_items", None)
+
+    STAC_ENDPOINT = config["stac"]["endpoint"]
+    STAC_COLLECTION = config["stac"]["collection"]
 
+    USE_INTERSECTS = bool(config.get("search", {}).get("use_intersects", True))
+    BBOX_PAD_KM = config.get("aoi", {}).get("bbox_pad_km", 0)
+
+    DOWNLOAD_MODE = str(config["download"].get("mode", "local")).lower()
+    DOWNLOAD_WORKERS = int(config["download"].get("parallel", 8))
+    PARTS_PER_FILE = int(config["download"].get("parts_per_file", 4))
+
+    ##search MPC STAC 
+    logger.info(f"STAC query -> collection: {STAC_COLLECTION}, "
+          f"dates: {START_DATE}/{END_DATE}, clouds <= {MAX_CLOUD_COVER if MAX_CLOUD_COVER is not None else 'ANY'}")
+    cat = _stac(STAC_ENDPOINT)
+
+    search_kwargs = dict(_build_search_kwargs(
+        STAC_COLLECTION, AOI_PATH, aoi_mtime(AOI_PATH), tuple(AOI_BBOX) if AOI_BBOX else None,
+        str(START_DATE), str(END_DATE), MAX_CLOUD_COVER, USE_INTERSECTS, BBOX_PAD_KM
+    ))
     search = cat.search(**search_kwargs)
     items = list(search.items())
     logger.info(f"Found {len(items)} STAC item(s)")
@@ -122,21 +308,21 @@ def download_landsat_scenes():
         logger.warning(f"Limiting to {MAX_ITEMS} item(s) for test")
 
     if not items:
-        print("0 items. Adjust dates/AOI/clouds.")
-        return []
+        logger.warning("0 items. Adjust dates/AOI/clouds.")
+        return
 
     ##debug first item
     a0 = items[0]
     logger.info(f"First item id: {a0.id}")
     logger.info(f"First item asset keys: {list((a0.assets or {}).keys())}")
 
-    results = []
     scenes_with_bands, files_downloaded = 0, 0
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    ##sign + download per item
+    ##sign + collect B4/B5 jobs per item
+    jobs = []
+    bboxes = {}
     for item in items:
-        sitem = pc.sign(item)  ##add SAS tokens
+        sitem = _signed(item)
         assets = sitem.assets or {}
         scene_id = sitem.id
 
@@ -144,53 +330,82 @@ def download_landsat_scenes():
             logger.warning(f"Skipping Landsat 7 (SLC-off) scene: {scene_id}")
             continue
 
-        ##prefer human-friendly keys; fall back to SR_B# variants
-        a_red = _pick(assets, ["red", "SR_B3", "SR_B4", "B3", "B4", "B03", "B04"])
-        a_nir = _pick(assets, ["nir08", "SR_B4", "SR_B5", "B4", "B5", "B04", "B05"])
+        lower = {k.lower(): k for k in assets}
+        a_red = _pick(assets, RED_KEYS, lower)
+        a_nir = _pick(assets, NIR_KEYS, lower)
         if not (a_red and a_nir):
             continue
 
         b4_out = os.path.join(OUTPUT_DIR, f"{scene_id}_SR_B4.TIF")
         b5_out = os.path.join(OUTPUT_DIR, f"{scene_id}_SR_B5.TIF")
+        jobs.append((scene_id, a_red.href, b4_out, a_nir.href, b5_out))
+        bboxes[scene_id] = sitem.bbox
 
-        skip_scene = False
-        for asset, dst in [(a_red, b4_out), (a_nir, b5_out)]:
-            try:
-                print(f"{scene_id}: {os.path.basename(dst)} <- {asset.href}")
-                with requests.get(asset.href, stream=True, timeout=240) as r:
-                    r.raise_for_status()
-                    if not _is_geotiff_header(r.headers):
-                        sample = (r.raw.read(1200) or b"").decode("utf-8", "ignore")
-                        logger.warning(f"Non-TIFF response at: {asset.href}")
-                        logger.info(f"Sample:\n{sample[:200]}")
-                        skip_scene = True
-                        break  
-                    with open(dst, "wb") as f:
-                        for chunk in r.iter_content(1024 * 1024):
-                            if chunk:
-                                f.write(chunk)
-                _ensure_big_tif(dst)
-                logger.info(f"{os.path.getsize(dst)/1e6:.1f} MB -> {dst}")
-                files_downloaded += 1
-            except Exception as e:
-                logger.error(f"Failed to download {os.path.basename(dst)}: {e}")
-                skip_scene = True
-                break
+    if DOWNLOAD_MODE == "vsicurl":
+        ##COGs are range-read by GDAL on demand; nothing is written locally
+        for scene_id, red_href, _, nir_href, _ in jobs:
+            yield {
+                "scene_id": scene_id,
+                "B4": f"/vsicurl/{red_href}",
+                "B5": f"/vsicurl/{nir_href}",
+                "bbox": bboxes[scene_id]
+            }
+        logger.info(f"Prepared {len(jobs)} scene(s) as /vsicurl/ references.")
+        return
 
-        if skip_scene:
-            logger.warning(f"Skipping scene: {scene_id}")
-            continue
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-        results.append({
-            "scene_id": scene_id,
-            "B4": b4_out,
-            "B5": b5_out
-        })
-        scenes_with_bands += 1
+    ##download a bounded window of scenes; a scene counts once both bands landed.
+    ##the next scene is submitted only as one resolves, so downloads run at most
+    ##DOWNLOAD_WORKERS scenes ahead of whoever consumes this generator
+    pending = {}
+    job_iter = iter(jobs)
+    with _make_pool(max(32, DOWNLOAD_WORKERS * PARTS_PER_FILE)) as http, \
+            ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as ex:
+        futs = {}
+
+        def _submit_next():
+            job = next(job_iter, None)
+            if job is None:
+                return
+            scene_id, red_href, b4_out, nir_href, b5_out = job
+            pending[scene_id] = {}
+            futs[ex.submit(_download_asset, http, red_href, b4_out, PARTS_PER_FILE)] = (scene_id, "B4", b4_out)
+            futs[ex.submit(_download_asset, http, nir_href, b5_out, PARTS_PER_FILE)] = (scene_id, "B5", b5_out)
+
+        for _ in range(max(1, DOWNLOAD_WORKERS)):
+            _submit_next()
+
+        while futs:
+            done, _ = wait(futs, return_when=FIRST_COMPLETED)
+            for fut in done:
+                scene_id, band, dst = futs.pop(fut)
+                ok = fut.result()
+                if ok:
+                    files_downloaded += 1
+                bands = pending[scene_id]
+                bands[band] = dst if ok else None
+                if len(bands) < 2:
+                    continue
+                del pending[scene_id]
+                _submit_next()
+                if not all(bands.values()):
+                    logger.warning(f"Skipping scene: {scene_id}")
+                    _forget_signed(scene_id)
+                    continue
+                scenes_with_bands += 1
+                yield {
+                    "scene_id": scene_id,
+                    "B4": bands["B4"],
+                    "B5": bands["B5"],
+                    "bbox": bboxes[scene_id]
+                }
 
     logger.info(f"Summary: items={len(items)}, scenes_with_B4&B5={scenes_with_bands}, files_downloaded={files_downloaded}")
-    logger.info(f"Prepared {len(results)} scene(s) with SR_B4 and SR_B5.")
-    return results
+    logger.info(f"Prepared {scenes_with_bands} scene(s) with SR_B4 and SR_B5.")
+
+def download_landsat_scenes():
+    return list(iter_landsat_scenes())
 
 if __name__ == "__main__":
     download_landsat_scenes()
@@ -1,19 +1,35 @@
 from pathlib import Path
-from datetime import datetime
+from functools import lru_cache
+from contextlib import contextmanager
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date
+from io import BytesIO
 import time
 import os
+import posixpath
 import math
+import struct
 import psycopg2
 import logging
 from psycopg2 import OperationalError
+from psycopg2.extras import execute_values, execute_batch
 import rasterio
-from rasterio.warp import calculate_default_transform, reproject, Resampling
-import geopandas as gpd
+from rasterio.io import MemoryFile
+from rasterio.shutil import copy as rio_copy
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import calculate_default_transform, Resampling
+from src.config import read_aoi
 import numpy as np
-from tempfile import NamedTemporaryFile
+try:
+    import bottleneck as bn  ##optional, single-pass nan reductions
+except ImportError:
+    bn = None
 
 logger = logging.getLogger(__name__)
 DEFAULT_TARGET_EPSG = int(os.getenv("DEFAULT_TARGET_EPSG", "32635"))
+##warp working memory shared by all reprojection threads, split evenly between them
+WARP_MEM_LIMIT_MB = 512
 
 def _utm_epsg_for_lonlat(lon: float, lat: float) -> int:
     zone = int(math.floor((lon + 180.0) / 6.0) + 1)
@@ -25,7 +41,11 @@ def choose_target_epsg(geojson_path: Path) -> int:
     If AOI is geographic (e.g., 4326) or missing, compute correct UTM from centroid.
     Fallback to DEFAULT_TARGET_EPSG if needed.
     """
-    gdf = gpd.read_file(geojson_path)
+    return _choose_target_epsg(str(geojson_path), os.path.getmtime(geojson_path))
+
+@lru_cache(maxsize=8)
+def _choose_target_epsg(geojson_path: str, mtime: float) -> int:
+    gdf = read_aoi(geojson_path)
     if gdf.crs is not None:
         epsg = gdf.crs.to_epsg()
         if epsg and epsg not in (4326, 4258): 
@@ -55,6 +75,20 @@ def _connect_with_retry():
             time.sleep(2)
     raise RuntimeError("Database never became reachable.")
 
+##bulk-load session defaults; a lost commit on crash just means re-running the load
+SESSION_SETTINGS = {
+    "synchronous_commit": "off",
+    "work_mem": "256MB",
+    "maintenance_work_mem": "1GB",
+}
+
+def _tune_session(cursor, overrides=None):
+    settings = {**SESSION_SETTINGS, **(overrides or {})}
+    for name, value in settings.items():
+        cursor.execute("SELECT set_config(%s, %s, false)", (name, str(value)))
+    cursor.connection.commit()
+    logger.info(f"Session settings: {settings}")
+
 ##helpers
 def _epsg_from_file_or_none(tif_path: Path):
     """Return EPSG int if present in file, else None (do NOT invent)."""
@@ -72,68 +106,250 @@ def _epsg_from_file_or_none(tif_path: Path):
     return None
 
 def _nanmean(band, nodata):
+    """Mean of finite, non-nodata pixels or None. A float32 band is masked in place."""
     arr = band.astype("float32", copy=False)
+    if bn is not None:
+        if nodata is not None:
+            np.putmask(arr, arr == nodata, np.nan)
+        ##nanmean is NaN only when every pixel is; inf means stray non-finite values
+        m = bn.nanmean(arr)
+        if np.isfinite(m):
+            return float(m)
+        if np.isnan(m):
+            return None
+    ##boolean mask + masked sum: no float32 copies of the band
+    valid = np.isfinite(arr)
     if nodata is not None:
-        arr = np.where(arr == nodata, np.nan, arr)
-    arr = np.where(np.isfinite(arr), arr, np.nan)
-    return None if np.isnan(arr).all() else float(np.nanmean(arr))
+        valid &= arr != nodata
+    n = np.count_nonzero(valid)
+    return float(arr.sum(where=valid, dtype="float64") / n) if n else None
+
+@contextmanager
+def _savepoint(cursor):
+    """A failure inside undoes only this block; the surrounding transaction stays usable."""
+    cursor.execute("SAVEPOINT etl_stmt")
+    try:
+        yield
+    except Exception:
+        cursor.execute("ROLLBACK TO SAVEPOINT etl_stmt")
+        ##ROLLBACK TO keeps the savepoint; release it so they don't pile up per failure
+        cursor.execute("RELEASE SAVEPOINT etl_stmt")
+        raise
+    cursor.execute("RELEASE SAVEPOINT etl_stmt")
 
 def safe_execute(cursor, sql, params):
     try:
-        cursor.execute(sql, params)
+        with _savepoint(cursor):
+            cursor.execute(sql, params)
+        return True
+    except Exception as e:
+        logger.warning(f"Insert failed: {e}")
+        return False
+
+def _batched(iterable, size: int):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _flush(cursor, rows, sql, template=None, page_size: int = 1000) -> bool:
+    """Multi-row INSERT via execute_values; a failed batch is undone on its own like safe_execute."""
+    if not rows:
+        return True
+    try:
+        with _savepoint(cursor):
+            execute_values(cursor, sql, rows, template=template, page_size=page_size)
+        return True
+    except Exception as e:
+        logger.error(f"Batch insert of {len(rows)} row(s) failed: {e}")
+        return False
+
+def _flush_batch(cursor, rows, sql, page_size: int = 50) -> bool:
+    """Per-row INSERT sent in pages via execute_batch; for upserts that don't fit VALUES %s."""
+    if not rows:
+        return True
+    try:
+        with _savepoint(cursor):
+            execute_batch(cursor, sql, rows, page_size=page_size)
         return True
     except Exception as e:
-        print(f"Insert failed: {e}")
-        cursor.connection.rollback()
+        logger.error(f"Batch upsert of {len(rows)} row(s) failed: {e}")
         return False
 
-def _reproject_to_epsg(src_path: Path, target_epsg: int, res_m: float = 30.0) -> Path:
+@contextmanager
+def _prepared(cursor, name: str, types, sql: str):
+    """
+    PREPARE sql server-side for the session and yield the matching
+    EXECUTE statement (one %s per type), DEALLOCATE on exit.
+    """
+    cursor.execute(f"PREPARE {name} ({', '.join(types)}) AS {sql}")
+    try:
+        yield f"EXECUTE {name} ({', '.join(['%s'] * len(types))})"
+    finally:
+        try:
+            cursor.execute(f"DEALLOCATE {name}")
+        except Exception as e:
+            logger.warning(f"DEALLOCATE {name} failed: {e}")
+            cursor.connection.rollback()
+
+##binary COPY: 11-byte signature, int32 flags, int32 header-extension length
+PGCOPY_HEADER = b"PGCOPY\n\377\r\n\0" + struct.pack("!ii", 0, 0)
+PG_EPOCH = date(2000, 1, 1)
+
+def _copy_field(value) -> bytes:
+    if value is None:
+        return struct.pack("!i", -1)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        data = bytes(value)
+    elif isinstance(value, str):
+        data = value.encode("utf-8")
+    elif isinstance(value, date):
+        data = struct.pack("!i", (value - PG_EPOCH).days)
+    elif isinstance(value, int):
+        data = struct.pack("!i", value)
+    elif isinstance(value, float):
+        data = struct.pack("!d", value)
+    else:
+        raise TypeError(f"Unsupported COPY value type: {type(value).__name__}")
+    return struct.pack("!i", len(data)) + data
+
+def _copy_binary_buffer(rows) -> BytesIO:
+    """
+    Encode rows as a PostgreSQL binary COPY stream.
+    Supports text, bytea, date, int4 and float8 columns.
+    """
+    buf = BytesIO()
+    buf.write(PGCOPY_HEADER)
+    for row in rows:
+        buf.write(struct.pack("!h", len(row)))
+        for value in row:
+            buf.write(_copy_field(value))
+    buf.write(struct.pack("!h", -1))
+    buf.seek(0)
+    return buf
+
+def _copy_rows(cursor, table: str, columns, rows) -> int:
+    rows = list(rows)
+    if rows:
+        cursor.copy_expert(
+            f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT BINARY)",
+            _copy_binary_buffer(rows),
+        )
+    return len(rows)
+
+def _copy_stage(cursor, table: str, columns, rows, batch_size: int) -> int:
+    """
+    Create a temp staging table from (name, type) pairs and binary-COPY
+    rows into it batch by batch. Dropped on commit.
+    """
+    cursor.execute(
+        f"CREATE TEMP TABLE {table} ({', '.join(f'{n} {t}' for n, t in columns)}) ON COMMIT DROP;"
+    )
+    names = [n for n, _ in columns]
+    staged = 0
+    for batch in _batched(rows, batch_size):
+        staged += _copy_rows(cursor, table, names, batch)
+    return staged
+
+def _stage_raster_sql(server_dir: str = None) -> str:
+    """
+    Raster bytes expression for the staging INSERT ... SELECT. pg_read_binary_file
+    needs superuser or pg_read_server_files, so it only appears with server_dir.
+    """
+    return "COALESCE(raw, pg_read_binary_file(server_file))" if server_dir else "raw"
+
+def _insert_from_stage(cursor, sql: str, table: str, staged: int) -> int:
+    """
+    Run the staging INSERT ... SELECT (sql has a {where} slot after FROM).
+    If one bad raster sinks the whole statement, retry row by row so the
+    rest still load. Returns the number of staged rows that went in.
+    """
+    if not staged:
+        return 0
+    if safe_execute(cursor, sql.format(where=""), None):
+        return staged
+    logger.error(f"Bulk insert from {table} failed for {staged} staged row(s); retrying row by row.")
+    cursor.execute(f"SELECT ctid::text FROM {table}")
+    ctids = [r[0] for r in cursor.fetchall()]
+    row_sql = sql.format(where="WHERE ctid = %s::tid")
+    loaded = sum(safe_execute(cursor, row_sql, (ctid,)) for ctid in ctids)
+    if loaded < staged:
+        logger.error(f"{staged - loaded} of {staged} row(s) from {table} failed to load.")
+    return loaded
+
+def _reproject_to_epsg(src_path: Path, target_epsg: int, res_m: float = 30.0, threads: int = None,
+                       warp_mem_mb: int = WARP_MEM_LIMIT_MB) -> bytes:
     """
     Reproject src_path to target_epsg at a fixed meter resolution.
-    Returns original path if already in target, else a temp file path.
+    Returns the GeoTIFF bytes: the file as-is if already in target,
+    else a copy warped in memory.
     """
-    with rasterio.open(src_path) as src:
+    threads = threads or os.cpu_count() or 1
+    with rasterio.Env(GDAL_NUM_THREADS=str(threads), GDAL_CACHEMAX=1024), rasterio.open(src_path) as src:
         if src.crs is None:
             raise ValueError(f"{src_path.name} has no CRS; cannot reproject safely.")
         src_epsg = src.crs.to_epsg()
         if src_epsg == target_epsg:
-            return src_path
+            return src_path.read_bytes()
 
         dst_crs = f"EPSG:{target_epsg}"
         transform, width, height = calculate_default_transform(
             src.crs, dst_crs, src.width, src.height, *src.bounds,
             dst_resolution=(res_m, res_m)
         )
-        meta = src.meta.copy()
-        meta.update({
-            "crs": dst_crs,
-            "transform": transform,
-            "width": width,
-            "height": height,
-            "driver": "GTiff",
-            "tiled": True,
-            "compress": meta.get("compress", "deflate"),
-            "BIGTIFF": "IF_SAFER",
-        })
-        nodata = meta.get("nodata", src.nodata)
-
-        with NamedTemporaryFile(suffix=".tif", delete=False) as tmp:
-            tmp_path = Path(tmp.name)
-
-        with rasterio.open(tmp_path, "w", **meta) as dst:
-            for i in range(1, src.count + 1):
-                reproject(
-                    source=rasterio.band(src, i),
-                    destination=rasterio.band(dst, i),
-                    src_transform=src.transform,
-                    src_crs=src.crs,
-                    dst_transform=transform,
-                    dst_crs=dst_crs,
-                    resampling=Resampling.bilinear if src.dtypes[i-1].startswith("float") else Resampling.nearest,
-                    src_nodata=nodata,
-                    dst_nodata=nodata,
-                )
-        return tmp_path
+        nodata = src.nodata
+        resampling = Resampling.bilinear if src.dtypes[0].startswith("float") else Resampling.nearest
+
+        ##virtual warp streamed block by block into the in-memory GeoTIFF
+        with WarpedVRT(src, crs=dst_crs, transform=transform, width=width, height=height,
+                       resampling=resampling, src_nodata=nodata, nodata=nodata,
+                       warp_mem_limit=warp_mem_mb, NUM_THREADS=threads) as vrt, \
+                MemoryFile(ext=".tif") as memfile:
+            rio_copy(vrt, memfile.name, driver="GTiff", tiled=True, compress="deflate", BIGTIFF="IF_SAFER")
+            return memfile.read()
+
+def _reproject_rows(jobs, workers: int, server_dir: str = None):
+    """
+    Warp (tif_path, epsg, head) jobs on a thread pool (GDAL releases the GIL)
+    and yield head + (raster_bytes, epsg, server_file) in job order. At most
+    2*workers rasters are in flight, so the DB side consumes while the next ones warp.
+    With server_dir (where the DB server sees these files), rasters already in
+    the target EPSG aren't read here: raster_bytes is None and server_file
+    is their server-side path.
+    """
+    workers = max(1, workers)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    warp_mem_mb = max(64, WARP_MEM_LIMIT_MB // workers)
+    window = deque()
+
+    def _take():
+        tif_path, epsg, head, fut = window.popleft()
+        if fut is None:
+            return head + (None, epsg, posixpath.join(server_dir, tif_path.name))
+        try:
+            return head + (fut.result(), epsg, None)
+        except Exception as e:
+            logger.warning(f"Skipping {tif_path.name}: reprojection failed: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        for tif_path, epsg, head in jobs:
+            if server_dir and _epsg_from_file_or_none(tif_path) == epsg:
+                window.append((tif_path, epsg, head, None))
+            else:
+                window.append((tif_path, epsg, head, ex.submit(_reproject_to_epsg, tif_path, epsg, 30.0, threads, warp_mem_mb)))
+            if len(window) >= 2 * workers:
+                row = _take()
+                if row:
+                    yield row
+        while window:
+            row = _take()
+            if row:
+                yield row
 
 ##AOIs
 def get_aoi_id(cursor, aoi_name: str = "AOI") -> int:
@@ -148,28 +364,26 @@ def get_aoi_id(cursor, aoi_name: str = "AOI") -> int:
         return row[0]
     raise RuntimeError("No AOIs found in database. You must load AOIs first.")
 
-def load_aois(cursor, geojson_path: Path):
+def load_aois(cursor, geojson_path: Path, batch_size: int = 1000):
     print("\nLoading AOIs...")
-    gdf = gpd.read_file(geojson_path)
+    gdf = read_aoi(geojson_path)
     gdf = gdf.set_crs(4326) if gdf.crs is None else gdf.to_crs(4326)
 
+    rows = [(row.get("name", f"aoi_{idx}"), row.geometry.wkt) for idx, row in gdf.iterrows()]
     count = 0
-    for idx, row in gdf.iterrows():
-        name = row.get("name", f"aoi_{idx}")
-        geom_wkt = row.geometry.wkt
-        ok = safe_execute(cursor, """
+    for batch in _batched(rows, batch_size):
+        ok = _flush(cursor, batch, """
             INSERT INTO aois (name, geom)
-            VALUES (%s, ST_Multi(ST_GeomFromText(%s, 4326)))
+            VALUES %s
             ON CONFLICT (name) DO NOTHING;
-        """, (name, geom_wkt))
+        """, template="(%s, ST_Multi(ST_GeomFromText(%s, 4326)))", page_size=batch_size)
         if ok:
-            count += 1
+            count += len(batch)
     logger.info(f"Loaded {count} AOI(s)")
 
 
 ##rasters
-def load_ndvi_full(cursor, ndvi_dir: Path, target_epsg: int):
-    logger.info("\nLoading full-scene NDVI rasters...")
+def _iter_full_jobs(ndvi_dir: Path, target_epsg: int):
     for tif_path in ndvi_dir.glob("*_NDVI.tif"):
         if "clipped" in tif_path.name:
             continue
@@ -194,35 +408,62 @@ def load_ndvi_full(cursor, ndvi_dir: Path, target_epsg: int):
             logger.error(f"Could not open {tif_path.name} as raster: {e}")
             continue
 
-        try:
-            reproj_path = _reproject_to_epsg(tif_path, target_epsg, res_m=30.0)
-        except Exception as e:
-            logger.warning(f"Skipping {tif_path.name}: reprojection failed: {e}")
-            continue
+        yield tif_path, target_epsg, (scene_id, acquisition_date, sensor, None)
 
-        with open(reproj_path, "rb") as f:
-            raster_data = f.read()
+def load_ndvi_full(cursor, ndvi_dir: Path, target_epsg: int, raster_batch: int = 8, use_copy: bool = True,
+                   workers: int = 4, server_dir: str = None):
+    """
+    Stage rasters into a temp table with binary COPY, then build the
+    PostGIS rasters server-side in a single INSERT ... SELECT.
+    With use_copy=False, rasters go in as batched multi-row INSERTs.
+    With server_dir, unwarped rasters are read server-side instead of sent.
+    """
+    logger.info("\nLoading full-scene NDVI rasters...")
+    jobs = _iter_full_jobs(ndvi_dir, target_epsg)
 
-        sql = """
+    if not use_copy:
+        rows = (row[:-1] for row in _reproject_rows(jobs, workers))
+        loaded = 0
+        with _prepared(cursor, "ins_ndvi_full", ("text", "date", "text", "float8", "bytea", "integer"), """
             INSERT INTO ndvi_full (scene_id, acquisition_date, sensor, cloud_cover, raster)
-            VALUES (%s, %s, %s, %s, ST_SetSRID(ST_FromGDALRaster(%s), %s))
-            ON CONFLICT (scene_id) DO NOTHING;
-        """
-        params = (scene_id, acquisition_date, sensor, None, raster_data, target_epsg)
-        safe_execute(cursor, sql, params)
+            VALUES ($1, $2, $3, $4, ST_SetSRID(ST_FromGDALRaster($5), $6))
+            ON CONFLICT (scene_id) DO NOTHING
+        """) as sql:
+            for batch in _batched(rows, raster_batch):
+                if _flush_batch(cursor, batch, sql, page_size=raster_batch):
+                    loaded += len(batch)
+        logger.info(f"Full NDVI loaded ({loaded} inserted).")
+        return
+
+    rows = _reproject_rows(jobs, workers, server_dir)
+    staged = _copy_stage(cursor, "stage_ndvi_full", (
+        ("scene_id", "TEXT"),
+        ("acquisition_date", "DATE"),
+        ("sensor", "TEXT"),
+        ("cloud_cover", "FLOAT8"),
+        ("raw", "BYTEA"),
+        ("srid", "INTEGER"),
+        ("server_file", "TEXT"),
+    ), rows, raster_batch)
+
+    loaded = _insert_from_stage(cursor, f"""
+        INSERT INTO ndvi_full (scene_id, acquisition_date, sensor, cloud_cover, raster)
+        SELECT scene_id, acquisition_date, sensor, cloud_cover, ST_SetSRID(ST_FromGDALRaster({_stage_raster_sql(server_dir)}), srid)
+        FROM stage_ndvi_full {{where}}
+        ON CONFLICT (scene_id) DO NOTHING;
+    """, "stage_ndvi_full", staged)
+
+    logger.info(f"Full NDVI loaded ({loaded} of {staged} staged).")
+
+def _iter_clipped_jobs(cursor, ndvi_dir: Path, aoi_id: int, target_epsg: int):
+    ##one query for all scene ids instead of one per file
+    cursor.execute("SELECT scene_id, id FROM ndvi_full")
+    full_ids = dict(cursor.fetchall())
 
-        if reproj_path != tif_path:
-            try: os.remove(reproj_path)
-            except Exception: pass
-
-    logger.info("Full NDVI loaded.")
-
-def load_ndvi_clipped(cursor, ndvi_dir: Path, aoi_id: int, target_epsg: int):
-    logger.info("\nLoading clipped NDVI rasters...")
     for tif_path in ndvi_dir.glob("*_NDVI_clipped.tif"):
         if "viz" in tif_path.name:
             continue
-        print(f"  → {tif_path.name}")
+        logger.info(f"  -> {tif_path.name}")
 
         parts = tif_path.stem.split('_')
         try:
@@ -233,49 +474,78 @@ def load_ndvi_clipped(cursor, ndvi_dir: Path, aoi_id: int, target_epsg: int):
             logger.warning(f"Skipping invalid filename: {tif_path.name} | {e}")
             continue
 
-        cursor.execute("SELECT id FROM ndvi_full WHERE scene_id = %s", (scene_id,))
-        r = cursor.fetchone()
-        if not r:
+        full_id = full_ids.get(scene_id)
+        if full_id is None:
             logger.warning(f"Skipping {tif_path.name}, full NDVI not found")
             continue
-        full_id = r[0]
 
         try:
             with rasterio.open(tif_path) as src:
-                band = src.read(1)
-                mean_ndvi = _nanmean(band, src.nodata)
+                ##mean written at clip time; empty tag means no valid pixels
+                tag = src.tags().get("MEAN_NDVI")
+                if tag is not None:
+                    mean_ndvi = float(tag) if tag else None
+                else:
+                    mean_ndvi = _nanmean(src.read(1), src.nodata)
+                    ##int16 products store NDVI / scale
+                    if mean_ndvi is not None:
+                        mean_ndvi *= src.scales[0]
         except Exception as e:
             logger.error(f"Could not read {tif_path.name} to compute mean: {e}")
             continue
 
-        try:
-            reproj_path = _reproject_to_epsg(tif_path, target_epsg, res_m=30.0)
-        except Exception as e:
-            logger.info(f"Skipping {tif_path.name}: reprojection failed: {e}")
-            continue
-
-        with open(reproj_path, "rb") as f:
-            raster_data = f.read()
+        yield tif_path, target_epsg, (full_id, aoi_id, acquisition_date, mean_ndvi)
 
-        sql = """
+def load_ndvi_clipped(cursor, ndvi_dir: Path, aoi_id: int, target_epsg: int,
+                      raster_batch: int = 8, use_copy: bool = True, workers: int = 4, server_dir: str = None):
+    """Same COPY staging as load_ndvi_full; use_copy=False falls back to execute_batch upserts."""
+    logger.info("\nLoading clipped NDVI rasters...")
+    jobs = _iter_clipped_jobs(cursor, ndvi_dir, aoi_id, target_epsg)
+
+    if use_copy:
+        rows = _reproject_rows(jobs, workers, server_dir)
+        staged = _copy_stage(cursor, "stage_ndvi_clipped", (
+            ("full_id", "INTEGER"),
+            ("aoi_id", "INTEGER"),
+            ("acquisition_date", "DATE"),
+            ("mean_ndvi", "FLOAT8"),
+            ("raw", "BYTEA"),
+            ("srid", "INTEGER"),
+            ("server_file", "TEXT"),
+        ), rows, raster_batch)
+        loaded = _insert_from_stage(cursor, f"""
             INSERT INTO ndvi_clipped (full_id, aoi_id, acquisition_date, mean_ndvi, raster)
-            VALUES (%s, %s, %s, %s, ST_SetSRID(ST_FromGDALRaster(%s), %s))
+            SELECT full_id, aoi_id, acquisition_date, mean_ndvi, ST_SetSRID(ST_FromGDALRaster({_stage_raster_sql(server_dir)}), srid)
+            FROM stage_ndvi_clipped {{where}}
             ON CONFLICT (full_id, aoi_id) DO UPDATE
               SET acquisition_date = EXCLUDED.acquisition_date,
                   mean_ndvi        = EXCLUDED.mean_ndvi,
                   raster           = EXCLUDED.raster;
-        """
-        params = (full_id, aoi_id, acquisition_date, mean_ndvi, raster_data, target_epsg)
-        safe_execute(cursor, sql, params)
-
-        if reproj_path != tif_path:
-            try: os.remove(reproj_path)
-            except Exception: pass
+        """, "stage_ndvi_clipped", staged)
+        logger.info(f"Clipped NDVI loaded ({loaded} of {staged} staged).")
+        return
+
+    rows = (row[:-1] for row in _reproject_rows(jobs, workers))
+    loaded = 0
+    with _prepared(cursor, "ups_ndvi_clipped", ("integer", "integer", "date", "float8", "bytea", "integer"), """
+        INSERT INTO ndvi_clipped (full_id, aoi_id, acquisition_date, mean_ndvi, raster)
+        VALUES ($1, $2, $3, $4, ST_SetSRID(ST_FromGDALRaster($5), $6))
+        ON CONFLICT (full_id, aoi_id) DO UPDATE
+          SET acquisition_date = EXCLUDED.acquisition_date,
+              mean_ndvi        = EXCLUDED.mean_ndvi,
+              raster           = EXCLUDED.raster
+    """) as sql:
+        for batch in _batched(rows, raster_batch):
+            if _flush_batch(cursor, batch, sql, page_size=raster_batch):
+                loaded += len(batch)
+    logger.info(f"Clipped NDVI loaded ({loaded} upserted).")
+
+def _iter_viz_jobs(cursor, ndvi_dir: Path, aoi_id: int):
+    cursor.execute("SELECT scene_id, id FROM ndvi_full")
+    full_ids = dict(cursor.fetchall())
+    cursor.execute("SELECT full_id, id FROM ndvi_clipped WHERE aoi_id=%s", (aoi_id,))
+    clipped_ids = dict(cursor.fetchall())
 
-    logger.info("Clipped NDVI loaded.")
-
-def load_ndvi_viz(cursor, ndvi_dir: Path, aoi_id: int):
-    logger.info("\nLoading NDVI viz rasters...")
     for tif_path in ndvi_dir.glob("*_NDVI_clipped_viz.tif"):
         parts = tif_path.stem.split('_')
         try:
@@ -286,46 +556,61 @@ def load_ndvi_viz(cursor, ndvi_dir: Path, aoi_id: int):
             logger.warning(f"Skipping invalid filename: {tif_path.name} | {e}")
             continue
 
-        cursor.execute("SELECT id FROM ndvi_full WHERE scene_id=%s", (scene_id,))
-        r = cursor.fetchone()
-        if not r:
+        full_id = full_ids.get(scene_id)
+        if full_id is None:
             logger.warning(f"No full NDVI for {scene_id}; skipping viz.")
             continue
-        full_id = r[0]
 
-        cursor.execute("SELECT id FROM ndvi_clipped WHERE full_id=%s AND aoi_id=%s", (full_id, aoi_id))
-        r2 = cursor.fetchone()
-        if not r2:
+        clipped_id = clipped_ids.get(full_id)
+        if clipped_id is None:
             logger.warning(f"No clipped NDVI for {scene_id} / AOI {aoi_id}; skipping viz.")
             continue
-        clipped_id = r2[0]
 
         style = "default"
-        try:
-            reproj_path = _reproject_to_epsg(tif_path, 3857, res_m=30.0)
-        except Exception as e:
-            logger.warning(f"Skipping viz {tif_path.name}: reprojection failed: {e}")
-            continue
-
-        with open(reproj_path, "rb") as f:
-            raster_data = f.read()
+        yield tif_path, 3857, (clipped_id, aoi_id, acquisition_date, style)
 
-        sql = """
+def load_ndvi_viz(cursor, ndvi_dir: Path, aoi_id: int, raster_batch: int = 8, use_copy: bool = True,
+                  workers: int = 4, server_dir: str = None):
+    logger.info("\nLoading NDVI viz rasters...")
+    jobs = _iter_viz_jobs(cursor, ndvi_dir, aoi_id)
+
+    if use_copy:
+        rows = _reproject_rows(jobs, workers, server_dir)
+        staged = _copy_stage(cursor, "stage_ndvi_viz", (
+            ("clipped_id", "INTEGER"),
+            ("aoi_id", "INTEGER"),
+            ("acquisition_date", "DATE"),
+            ("style", "TEXT"),
+            ("raw", "BYTEA"),
+            ("srid", "INTEGER"),
+            ("server_file", "TEXT"),
+        ), rows, raster_batch)
+        loaded = _insert_from_stage(cursor, f"""
             INSERT INTO ndvi_viz (clipped_id, aoi_id, acquisition_date, style, raster)
-            VALUES (%s, %s, %s, %s, ST_SetSRID(ST_FromGDALRaster(%s), %s))
+            SELECT clipped_id, aoi_id, acquisition_date, style, ST_SetSRID(ST_FromGDALRaster({_stage_raster_sql(server_dir)}), srid)
+            FROM stage_ndvi_viz {{where}}
             ON CONFLICT (clipped_id) DO UPDATE
               SET acquisition_date = EXCLUDED.acquisition_date,
                   style            = EXCLUDED.style,
                   raster           = EXCLUDED.raster;
-        """
-        params = (clipped_id, aoi_id, acquisition_date, style, raster_data, 3857)
-        safe_execute(cursor, sql, params)
-
-        if reproj_path != tif_path:
-            try: os.remove(reproj_path)
-            except Exception: pass
-
-    logger.info("NDVI viz loaded.")
+        """, "stage_ndvi_viz", staged)
+        logger.info(f"NDVI viz loaded ({loaded} of {staged} staged).")
+        return
+
+    rows = (row[:-1] for row in _reproject_rows(jobs, workers))
+    loaded = 0
+    with _prepared(cursor, "ups_ndvi_viz", ("integer", "integer", "date", "text", "bytea", "integer"), """
+        INSERT INTO ndvi_viz (clipped_id, aoi_id, acquisition_date, style, raster)
+        VALUES ($1, $2, $3, $4, ST_SetSRID(ST_FromGDALRaster($5), $6))
+        ON CONFLICT (clipped_id) DO UPDATE
+          SET acquisition_date = EXCLUDED.acquisition_date,
+              style            = EXCLUDED.style,
+              raster           = EXCLUDED.raster
+    """) as sql:
+        for batch in _batched(rows, raster_batch):
+            if _flush_batch(cursor, batch, sql, page_size=raster_batch):
+                loaded += len(batch)
+    logger.info(f"NDVI viz loaded ({loaded} upserted).")
 
 
 ##raster constraints for QGIS needs srid in raster_columns
@@ -354,31 +639,39 @@ def add_raster_constraints_metadata(cursor):
     logger.info("Added metadata constraints.")
 
 
-def run_loader():
+def run_loader(load_opts=None):
     logger.info("\nStarting full ETL Load to PostGIS...")
+    opts = load_opts or {}
+    batch_size = int(opts.get("batch_size", 1000))
+    raster_batch = int(opts.get("raster_batch", 8))
+    use_copy = bool(opts.get("use_copy", True))
+    workers = int(opts.get("workers") or 4)
+    server_dir = opts.get("server_dir")
     ndvi_dir = Path("data/processed")
     geojson_path = Path("data/aoi/boundary.geojson")
 
     conn = _connect_with_retry()
     cursor = conn.cursor()
     try:
+        _tune_session(cursor, opts.get("session"))
+
         target_epsg = choose_target_epsg(geojson_path)
         logger.info(f"Using TARGET_EPSG={target_epsg} for rasters (AOI-driven)")
 
         drop_raster_constraints(cursor)
 
-        load_aois(cursor, geojson_path)
+        load_aois(cursor, geojson_path, batch_size)
         conn.commit()
 
         aoi_id = get_aoi_id(cursor, "AOI")
 
-        load_ndvi_full(cursor, ndvi_dir, target_epsg)
+        load_ndvi_full(cursor, ndvi_dir, target_epsg, raster_batch, use_copy, workers, server_dir)
         conn.commit()
 
-        load_ndvi_clipped(cursor, ndvi_dir, aoi_id, target_epsg)
+        load_ndvi_clipped(cursor, ndvi_dir, aoi_id, target_epsg, raster_batch, use_copy, workers, server_dir)
         conn.commit()
 
-        load_ndvi_viz(cursor, ndvi_dir, aoi_id)  
+        load_ndvi_viz(cursor, ndvi_dir, aoi_id, raster_batch, use_copy, workers, server_dir)
         conn.commit()
 
         add_raster_constraints_metadata(cursor)
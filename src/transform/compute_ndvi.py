@@ -1,97 +1,177 @@
 import numpy as np
-import geopandas as gpd
 import rasterio
+from rasterio.crs import CRS
 from rasterio.mask import mask
 from rasterio.transform import array_bounds
 from rasterio.warp import calculate_default_transform, reproject, Resampling
 from rasterio.warp import transform_geom
+from rasterio.windows import Window
 from shapely.geometry import box, shape
 from shapely.errors import TopologicalError
-import yaml, os, logging
+import os, shutil, logging
+from functools import lru_cache
+from src.config import get_settings, read_aoi
+try:
+    import numexpr as ne  ##optional, fused multithreaded NDVI
+except ImportError:
+    ne = None
 
 logger = logging.getLogger(__name__)
 
 WRITE_LOCAL_CLIP = os.getenv("WRITE_LOCAL_CLIP", "0") == "1"
 WRITE_LOCAL_VIZ  = os.getenv("WRITE_LOCAL_VIZ",  "0") == "1"
 
-##config reader for product options
-def _load_product_opts():
-    here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    candidates = [
-        os.path.join(here, "config", "settings.yaml"),
-        os.path.join(os.path.dirname(here), "config", "settings.yaml"),
-    ]
-    for p in candidates:
-        if os.path.exists(p):
-            with open(p, "r", encoding="utf-8-sig") as f:
-                cfg = yaml.safe_load(f)
-            prod = cfg.get("products", {}) if cfg else {}
-            return prod.get("reproject_crs", None), bool(prod.get("build_overviews", False))
-    return None, False
-
-def compute_ndvi(b4_path, b5_path, out_path):
-    # Landsat Collection 2 Level-2 SR scale/offset
-    SCALE, OFFSET = np.float32(0.0000275), np.float32(-0.2)
-    EPS = np.float32(1e-6)
-    NODATA_OUT = np.float32(-9999.0)
+# Landsat Collection 2 Level-2 SR scale/offset
+SR_SCALE, SR_OFFSET = np.float32(0.0000275), np.float32(-0.2)
+NDVI_EPS = np.float32(1e-6)
+NDVI_NODATA = np.float32(-9999.0)
+# Scale/offset folded into the DN domain, computed once:
+# (nir - red) / (nir + red + EPS) == (n - r) / (n + r + (2*OFFSET + EPS)/SCALE)
+DN_DENOM_SHIFT = np.float32((2 * SR_OFFSET + NDVI_EPS) / SR_SCALE)
 
-    with rasterio.open(b4_path) as r4, rasterio.open(b5_path) as r5:
-        if (r4.width, r4.height, r4.transform) != (r5.width, r5.height, r5.transform):
-            raise ValueError("B4 and B5 rasters are not on the same grid.")
+##int16 storage: stored value = round(NDVI / NDVI_INT16_SCALE); readers multiply back
+NDVI_INT16_SCALE = 1e-4
+NDVI_INT16_NODATA = -32768
 
-        # Read as float32 directly to avoid extra casts
-        red_dn = r4.read(1).astype("float32", copy=False)
-        nir_dn = r5.read(1).astype("float32", copy=False)
+##config reader for product options
+def _load_product_opts():
+    try:
+        prod = get_settings().get("products", {}) or {}
+    except FileNotFoundError:
+        return None, False
+    return prod.get("reproject_crs", None), bool(prod.get("build_overviews", False))
 
-        # --- Build masks BEFORE scaling ---
-        # Landsat SR: DN==0 is fill (NoData). Also respect input nodata if set.
-        mask = (red_dn == 0) | (nir_dn == 0)
-        if r4.nodata is not None:
-            mask |= (red_dn == r4.nodata)
-        if r5.nodata is not None:
-            mask |= (nir_dn == r5.nodata)
+def _ndvi_dtype():
+    try:
+        dtype = str((get_settings().get("products", {}) or {}).get("ndvi_dtype", "float32"))
+    except FileNotFoundError:
+        return "float32"
+    if dtype not in ("float32", "int16"):
+        raise ValueError(f"products.ndvi_dtype must be float32 or int16, got {dtype}")
+    return dtype
 
-        # Apply scale/offset
-        red = red_dn * SCALE + OFFSET
-        nir = nir_dn * SCALE + OFFSET
+def _mean_ndvi_tag(arr, nodata, scale=1.0):
+    """Mean of valid pixels for the MEAN_NDVI tag; empty string when none are valid."""
+    valid = np.isfinite(arr)
+    if nodata is not None:
+        valid &= arr != nodata
+    if not valid.any():
+        return ""
+    return repr(float(arr.mean(where=valid, dtype="float64")) * scale)
 
-        # Any remaining non-finite values: mask them
-        mask |= ~np.isfinite(red) | ~np.isfinite(nir)
+def _ndvi_block(red_dn, nir_dn, nodata4, nodata5):
+    """NDVI for one window of raw DNs, fill applied and clamped to [-1, 1]."""
+    # --- Build masks BEFORE scaling ---
+    # Landsat SR: DN==0 is fill (NoData). Also respect input nodata if set.
+    mask = red_dn == 0
+    mask |= nir_dn == 0
+    # SR nodata is 0 already; skip comparisons that can't add anything
+    if nodata4 not in (None, 0):
+        mask |= red_dn == nodata4
+    if nodata5 not in (None, 0):
+        mask |= nir_dn == nodata5
+    # Integer DNs are always finite; only float inputs need the check
+    if not np.issubdtype(red_dn.dtype, np.integer) or not np.issubdtype(nir_dn.dtype, np.integer):
+        mask |= ~np.isfinite(red_dn)
+        mask |= ~np.isfinite(nir_dn)
 
+    if ne is not None:
+        # NDVI in one fused pass
+        ndvi = ne.evaluate(
+            "(n - r) / (n + r + K)",
+            local_dict={"r": red_dn.astype("float32", copy=False),
+                        "n": nir_dn.astype("float32", copy=False), "K": DN_DENOM_SHIFT},
+        ).astype("float32", copy=False)
+    else:
         # --- FP-safe NDVI ---
-        denom = nir + red
-        # Add epsilon so denom is never exactly 0 in vectorized native code
+        # ufuncs cast element-wise, so only the two float32 outputs are allocated
         with np.errstate(divide='ignore', invalid='ignore', over='ignore', under='ignore'):
-            ndvi = (nir - red) / (denom + EPS)
+            ndvi = np.subtract(nir_dn, red_dn, dtype=np.float32)
+            denom = np.add(nir_dn, red_dn, dtype=np.float32)
+            denom += DN_DENOM_SHIFT
+            ndvi /= denom
+        del denom
+
+    # clamp everything in place, then fill: no masked gather/scatter needed
+    np.clip(ndvi, -1.0, 1.0, out=ndvi)
+    np.putmask(ndvi, mask, NDVI_NODATA)
+    return ndvi
 
-        # Clean & clamp
-        ndvi = np.where(mask, NODATA_OUT, ndvi).astype("float32", copy=False)
-        # clamp real values; leave NoData alone
-        real = ndvi != NODATA_OUT
-        ndvi[real] = np.clip(ndvi[real], -1.0, 1.0, out=ndvi[real])
+def compute_ndvi(b4_path, b5_path, out_path, block=512, dtype=None):
+    as_int16 = (dtype or _ndvi_dtype()) == "int16"
+
+    with rasterio.open(b4_path) as r4, rasterio.open(b5_path) as r5:
+        if (r4.width, r4.height, r4.transform) != (r5.width, r5.height, r5.transform):
+            raise ValueError("B4 and B5 rasters are not on the same grid.")
 
         profile = r4.profile.copy()
         profile.update(
             driver="GTiff",
             dtype="float32",
             count=1,
-            nodata=float(NODATA_OUT),
+            nodata=float(NDVI_NODATA),
             compress="deflate",
             predictor=3,
             zlevel=6,
             tiled=True,              # safer for big rasters
-            blockxsize=256,
-            blockysize=256,
+            blockxsize=block,
+            blockysize=block,
         )
+        if as_int16:
+            profile.update(dtype="int16", nodata=NDVI_INT16_NODATA, predictor=2)
 
+        ##stream tile by tile: peak memory is one block, not the whole scene
+        total, count = 0.0, 0
         with rasterio.open(out_path, "w", **profile) as dst:
-            dst.write(ndvi, 1)
+            for _, window in dst.block_windows(1):
+                ndvi = _ndvi_block(r4.read(1, window=window), r5.read(1, window=window),
+                                   r4.nodata, r5.nodata)
+                valid = ndvi != NDVI_NODATA
+                total += float(ndvi.sum(where=valid, dtype="float64"))
+                count += int(np.count_nonzero(valid))
+                if as_int16:
+                    ndvi /= NDVI_INT16_SCALE
+                    np.rint(ndvi, out=ndvi)
+                    ndvi = ndvi.astype(np.int16)
+                    np.putmask(ndvi, ~valid, NDVI_INT16_NODATA)
+                dst.write(ndvi, 1, window=window)
+            if as_int16:
+                dst.scales = (NDVI_INT16_SCALE,)
+            ##loader reads this instead of rescanning the raster
+            dst.update_tags(MEAN_NDVI=repr(total / count) if count else "")
             # (Optional) build overviews later in a separate step/process
             # dst.build_overviews([2, 4, 8, 16], Resampling.average)
 
     logger.info(f"NDVI saved to {out_path}")
     return out_path
 
+def _prepare_aoi_geom(aoi_path, dst_crs):
+    """AOI as one cleaned geometry in dst_crs; scenes sharing a UTM zone reuse it."""
+    return _prepare_aoi_geom_cached(str(aoi_path), os.path.getmtime(aoi_path), dst_crs.to_wkt())
+
+@lru_cache(maxsize=8)
+def _prepare_aoi_geom_cached(aoi_path, mtime, crs_wkt):
+    aoi = read_aoi(aoi_path)
+    if aoi.empty:
+        raise ValueError(f"AOI is empty: {aoi_path}")
+    if aoi.crs is None:
+        aoi = aoi.set_crs("EPSG:4326")
+    logger.info(f"AOI bounds (WGS84): {tuple(round(v, 4) for v in aoi.to_crs(4326).total_bounds)}")
+
+    try:
+        aoi_proj = aoi.to_crs(crs_wkt)
+    except Exception as e:
+        raise ValueError(f"Failed to reproject AOI to raster CRS {crs_wkt}: {e}")
+
+    try:
+        geom = aoi_proj.geometry.unary_union
+        if geom.is_empty:
+            raise ValueError("AOI geometry became empty after reprojection.")
+        geom = geom.buffer(0)
+    except TopologicalError:
+        geom = aoi_proj.buffer(0).unary_union
+    return geom
+
 def clip_raster_to_aoi(raster_path, aoi_path, out_path):
     with rasterio.open(raster_path) as src:
         dst_crs = src.crs
@@ -105,25 +185,7 @@ def clip_raster_to_aoi(raster_path, aoi_path, out_path):
         except Exception:
             pass
 
-        aoi = gpd.read_file(aoi_path)
-        if aoi.empty:
-            raise ValueError(f"AOI is empty: {aoi_path}")
-        if aoi.crs is None:
-            aoi = aoi.set_crs("EPSG:4326")
-        logger.info(f"AOI bounds (WGS84): {tuple(round(v, 4) for v in aoi.to_crs(4326).total_bounds)}")
-
-        try:
-            aoi_proj = aoi.to_crs(dst_crs)
-        except Exception as e:
-            raise ValueError(f"Failed to reproject AOI to raster CRS {dst_crs}: {e}")
-
-        try:
-            geom = aoi_proj.geometry.unary_union
-            if geom.is_empty:
-                raise ValueError("AOI geometry became empty after reprojection.")
-            geom = geom.buffer(0)
-        except TopologicalError:
-            geom = aoi_proj.buffer(0).unary_union
+        geom = _prepare_aoi_geom(aoi_path, dst_crs)
 
         if not geom.intersects(ras_poly_dst):
             ##small buffer in raster units (in this case meters for UTM)
@@ -133,13 +195,41 @@ def clip_raster_to_aoi(raster_path, aoi_path, out_path):
 
         out_arr, out_transform = mask(src, shapes=[geom.__geo_interface__], crop=True, nodata=src.nodata)
         out_meta = src.meta.copy()
+        scales = src.scales
         out_meta.update({"height": out_arr.shape[1], "width": out_arr.shape[2], "transform": out_transform})
 
     with rasterio.open(out_path, "w", **out_meta) as dst:
         dst.write(out_arr)
+        dst.scales = scales
+        dst.update_tags(MEAN_NDVI=_mean_ndvi_tag(out_arr[0], out_meta.get("nodata"), scales[0]))
 
     logger.info(f"Clipped raster saved to {out_path}")
+    _finalize_clipped(out_path)
+    return out_path
 
+def link_as_clipped(raster_path, out_path):
+    """
+    Publish raster_path as the clipped product without re-masking, for
+    scenes whose footprint lies entirely inside the AOI.
+    """
+    _, build_ovr = _load_product_opts()
+    if os.path.exists(out_path):
+        os.remove(out_path)
+    ##overviews are written in place, so only hardlink when none will be built
+    linked = False
+    if not build_ovr:
+        try:
+            os.link(raster_path, out_path)
+            linked = True
+        except OSError:
+            pass
+    if not linked:
+        shutil.copyfile(raster_path, out_path)
+    logger.info(f"Scene inside AOI, clip skipped: {out_path}")
+    _finalize_clipped(out_path)
+    return out_path
+
+def _finalize_clipped(out_path):
     ##build overviews and/or reproject
     target_crs, build_ovr = _load_product_opts()
     if build_ovr:
@@ -150,30 +240,81 @@ def clip_raster_to_aoi(raster_path, aoi_path, out_path):
 
     if target_crs:
         reproj_path = os.path.splitext(out_path)[0] + "_viz.tif"
-        _reproject_raster(out_path, reproj_path, target_crs)
-        if build_ovr:
+        warped = _reproject_raster(out_path, reproj_path, target_crs)
+        ##a linked copy already carries the overviews built above
+        if build_ovr and warped:
             with rasterio.open(reproj_path, "r+") as ds:
                 ds.build_overviews([2, 4, 8, 16, 32], Resampling.average)
                 ds.update_tags(ns="rio_overview", resampling="average")
         logger.info(f"Reprojected for viz -> {target_crs}: {reproj_path}")
 
-    return out_path
+def init_ndvi_zarr(store_path):
+    """Create the Zarr group that per-scene NDVI arrays are written into (needs zarr)."""
+    import zarr
+    return zarr.open_group(store_path, mode="a")
+
+def write_ndvi_zarr(raster_path, store_path, name, chunk=512):
+    """
+    Copy a single-band NDVI GeoTIFF into store_path/name as a chunked,
+    zstd-compressed Zarr array. Reads are chunk-row strips so each Zarr
+    chunk is written exactly once.
+    """
+    import zarr, numcodecs
+    with rasterio.open(raster_path) as src:
+        arr = zarr.open_array(
+            os.path.join(store_path, name), mode="w",
+            shape=(src.height, src.width), chunks=(chunk, chunk),
+            dtype=src.dtypes[0], fill_value=src.nodata,
+            compressor=numcodecs.Blosc(cname="zstd", clevel=3, shuffle=numcodecs.Blosc.BITSHUFFLE),
+        )
+        for row in range(0, src.height, chunk):
+            height = min(chunk, src.height - row)
+            arr[row:row + height, :] = src.read(1, window=Window(0, row, src.width, height))
+        arr.attrs.update({
+            "crs": src.crs.to_wkt() if src.crs else None,
+            "transform": list(src.transform)[:6],
+            "nodata": src.nodata,
+            "scale_factor": src.scales[0],
+        })
+    logger.info(f"Zarr copy -> {os.path.join(store_path, name)}")
+    return arr
+
+WARP_MEM_LIMIT_MB = 512
+
+def _warp_threads() -> int:
+    ##pool workers pin GDAL_NUM_THREADS to their share of the cores
+    n = os.environ.get("GDAL_NUM_THREADS", "")
+    return int(n) if n.isdigit() else (os.cpu_count() or 1)
 
 def _reproject_raster(in_path, out_path, target_crs):
+    """Warp in_path to target_crs. Returns False when it was already there and got linked instead."""
     with rasterio.open(in_path) as src:
+        if src.crs == CRS.from_user_input(target_crs):
+            ##identity warp: same pixels, so link (or copy) instead of resampling
+            if os.path.exists(out_path):
+                os.remove(out_path)
+            try:
+                os.link(in_path, out_path)
+            except OSError:
+                shutil.copyfile(in_path, out_path)
+            return False
         transform, width, height = calculate_default_transform(
             src.crs, target_crs, src.width, src.height, *src.bounds
         )
         kwargs = src.meta.copy()
         kwargs.update({"crs": target_crs, "transform": transform, "width": width, "height": height})
         with rasterio.open(out_path, "w", **kwargs) as dst:
-            for i in range(1, src.count + 1):
-                reproject(
-                    source=rasterio.band(src, i),
-                    destination=rasterio.band(dst, i),
-                    src_transform=src.transform,
-                    src_crs=src.crs,
-                    dst_transform=transform,
-                    dst_crs=target_crs,
-                    resampling=Resampling.bilinear,  ##continuous NDVI
-                )
+            dst.scales = src.scales
+            bands = list(range(1, src.count + 1))
+            reproject(
+                source=rasterio.band(src, bands),
+                destination=rasterio.band(dst, bands),
+                src_transform=src.transform,
+                src_crs=src.crs,
+                dst_transform=transform,
+                dst_crs=target_crs,
+                resampling=Resampling.bilinear,  ##continuous NDVI
+                num_threads=_warp_threads(),
+                warp_mem_limit=WARP_MEM_LIMIT_MB,
+            )
+    return True
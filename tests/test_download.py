@@ -0,0 +1,100 @@
+import os
+import threading
+import pytest
+from src.extract.download_landsat_stac import _split_ranges, _fetch_range, _is_complete_local, _download_asset, MIN_TIF_BYTES
+
+class FakeResponse:
+    def __init__(self, body, status=206):
+        self.status = status
+        self._body = body
+    def read(self, n):
+        chunk, self._body = self._body[:n], self._body[n:]
+        return chunk
+    def release_conn(self):
+        pass
+
+class FakeHttp:
+    def __init__(self, body, status=206):
+        self.body, self.status = body, status
+    def request(self, method, url, headers=None, preload_content=True):
+        return FakeResponse(self.body, self.status)
+
+@pytest.mark.parametrize("size,parts", [(100, 4), (101, 4), (7, 3), (10, 1), (3, 8)])
+def test_split_ranges_cover_file(size, parts):
+    ranges = _split_ranges(size, parts)
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == size - 1
+    for (_, prev_end), (start, _) in zip(ranges, ranges[1:]):
+        assert start == prev_end + 1
+    assert sum(end - start + 1 for start, end in ranges) == size
+    assert len(ranges) <= parts
+
+def test_fetch_range_rejects_non_tiff(tmp_path):
+    dst = tmp_path / "band.tif"
+    fd = os.open(dst, os.O_RDWR | os.O_CREAT, 0o644)
+    abort = threading.Event()
+    try:
+        with pytest.raises(ValueError, match="Non-TIFF"):
+            _fetch_range(FakeHttp(b"<html>denied</html>"), "http://x/b.tif", fd, 0, 18, abort)
+    finally:
+        os.close(fd)
+    assert abort.is_set()
+
+def test_fetch_range_requires_206(tmp_path):
+    dst = tmp_path / "band.tif"
+    fd = os.open(dst, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        with pytest.raises(ValueError, match="not honored"):
+            _fetch_range(FakeHttp(b"II*\x00" + b"\x00" * 12, status=200), "http://x/b.tif", fd, 0, 15, threading.Event())
+    finally:
+        os.close(fd)
+
+def test_fetch_range_error_aborts_siblings(tmp_path):
+    dst = tmp_path / "band.tif"
+    fd = os.open(dst, os.O_RDWR | os.O_CREAT, 0o644)
+    abort = threading.Event()
+    try:
+        with pytest.raises(IOError, match="HTTP 500"):
+            _fetch_range(FakeHttp(b"", status=500), "http://x/b.tif", fd, 16, 31, abort)
+    finally:
+        os.close(fd)
+    assert abort.is_set()
+
+def test_is_complete_local_size_mismatch(tmp_path):
+    dst = tmp_path / "band.tif"
+    dst.write_bytes(b"II*\x00" + b"\x00" * 96)
+    assert _is_complete_local(str(dst), 100)
+    assert not _is_complete_local(str(dst), 101)
+    assert not _is_complete_local(str(dst), 0)
+    dst.write_bytes(b"<htm" + b"\x00" * 96)
+    assert not _is_complete_local(str(dst), 100)
+
+def test_download_asset_renames_only_complete_file(tmp_path):
+    dst = str(tmp_path / "band.tif")
+    body = b"II*\x00" + b"\x00" * MIN_TIF_BYTES
+    assert _download_asset(FakeHttp(body, status=200), "http://x/b.tif", dst)
+    assert os.path.getsize(dst) == len(body)
+    assert not os.path.exists(dst + ".part")
+
+def test_download_asset_failure_leaves_nothing(tmp_path):
+    dst = str(tmp_path / "band.tif")
+    assert not _download_asset(FakeHttp(b"II*\x00" + b"\x00" * 100, status=200), "http://x/b.tif", dst)
+    assert not os.path.exists(dst)
+    assert not os.path.exists(dst + ".part")
+
+def test_signed_cache_is_bounded(monkeypatch):
+    import planetary_computer
+    import src.extract.download_landsat_stac as dl
+
+    class Item:
+        def __init__(self, item_id):
+            self.id = item_id
+        def get_self_href(self):
+            return None
+
+    monkeypatch.setattr(planetary_computer, "sign", lambda item: item)
+    monkeypatch.setattr(dl, "SIGNED_MAX", 3)
+    monkeypatch.setattr(dl, "_SIGNED", dl.OrderedDict())
+    for item_id in ("a", "b", "c", "a", "d", "e"):
+        dl._signed(Item(item_id))
+    assert [k[0] for k in dl._SIGNED] == ["a", "d", "e"]
@@ -0,0 +1,41 @@
+import struct
+from datetime import date
+from src.load.load_to_postgis import _copy_binary_buffer, PGCOPY_HEADER
+
+def test_copy_binary_buffer_layout():
+    buf = _copy_binary_buffer([("LC08_X", date(2000, 1, 2), None, b"\x01\x02", 32635)]).read()
+
+    assert buf.startswith(PGCOPY_HEADER)
+    body = buf[len(PGCOPY_HEADER):]
+    assert struct.unpack("!h", body[:2])[0] == 5
+    expected = (
+        struct.pack("!i", 6) + b"LC08_X"
+        + struct.pack("!ii", 4, 1)
+        + struct.pack("!i", -1)
+        + struct.pack("!i", 2) + b"\x01\x02"
+        + struct.pack("!ii", 4, 32635)
+    )
+    assert body[2:-2] == expected
+    assert body[-2:] == struct.pack("!h", -1)
+
+class FakeCursor:
+    """Records statements; any INSERT touching a ctid in bad fails, as does the bulk one."""
+    def __init__(self, ctids, bad):
+        self.ctids, self.bad, self.executed = ctids, bad, []
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+        if sql.lstrip().startswith("INSERT") and (params is None or params[0] in self.bad):
+            raise RuntimeError("raster failed")
+    def fetchall(self):
+        return [(c,) for c in self.ctids]
+
+def test_insert_from_stage_falls_back_per_row():
+    from src.load.load_to_postgis import _insert_from_stage
+    cur = FakeCursor(["(0,1)", "(0,2)", "(0,3)"], bad={"(0,2)"})
+    loaded = _insert_from_stage(cur, "INSERT INTO t SELECT * FROM stage {where};", "stage", 3)
+
+    assert loaded == 2
+    row_inserts = [p for sql, p in cur.executed if "ctid = %s::tid" in sql]
+    assert row_inserts == [("(0,1)",), ("(0,2)",), ("(0,3)",)]
+    rollback = cur.executed.index(("ROLLBACK TO SAVEPOINT etl_stmt", None))
+    assert cur.executed[rollback + 1] == ("RELEASE SAVEPOINT etl_stmt", None)
@@ -1,10 +1,10 @@
 import numpy as np
 import rasterio
-from src.transform.compute_ndvi import compute_ndvi
+from src.transform.compute_ndvi import compute_ndvi, SR_SCALE, SR_OFFSET, NDVI_EPS
 import tempfile
 import os
 ##
-def create_dummy_band(shape=(100, 100), value=1000, path=None):
+def create_dummy_band(shape=(100, 100), value=1000, path=None, data=None):
     profile = {
         'driver': 'GTiff',
         'height': shape[0],
@@ -16,7 +16,8 @@ def create_dummy_band(shape=(100, 100), value=1000, path=None):
         'nodata': 0
     }
     with rasterio.open(path, 'w', **profile) as dst:
-        data = np.full(shape, value, dtype='uint16')
+        if data is None:
+            data = np.full(shape, value, dtype='uint16')
         dst.write(data, 1)
 
 def test_compute_ndvi_basic():
@@ -35,3 +36,55 @@ def test_compute_ndvi_basic():
             assert np.all(np.isfinite(ndvi))
             assert ndvi.shape == (100, 100)
             assert np.all((ndvi >= -1.0) & (ndvi <= 1.0))
+
+def test_compute_ndvi_int16():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        b4_path = os.path.join(tmpdir, 'B4.tif')
+        b5_path = os.path.join(tmpdir, 'B5.tif')
+        out_path = os.path.join(tmpdir, 'ndvi.tif')
+
+        create_dummy_band(value=1000, path=b4_path)
+        create_dummy_band(value=3000, path=b5_path)
+
+        compute_ndvi(b4_path, b5_path, out_path, dtype="int16")
+
+        with rasterio.open(out_path) as src:
+            assert src.dtypes[0] == 'int16'
+            assert src.nodata == -32768
+            ndvi = src.read(1) * src.scales[0]
+            assert np.all((ndvi >= -1.0) & (ndvi <= 1.0))
+            assert abs(ndvi.mean() - float(src.tags()['MEAN_NDVI'])) < 1e-4
+
+def test_compute_ndvi_matches_reflectance_formula():
+    ##larger than one 512 block, with DN==0 fill in both bands
+    rng = np.random.default_rng(0)
+    shape = (900, 1100)
+    red = rng.integers(7500, 20000, shape, dtype='uint16')
+    nir = rng.integers(7500, 30000, shape, dtype='uint16')
+    red[:40, :] = 0
+    nir[:, -25:] = 0
+    red[600:610, 700:900] = 0
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        b4_path = os.path.join(tmpdir, 'B4.tif')
+        b5_path = os.path.join(tmpdir, 'B5.tif')
+        out_path = os.path.join(tmpdir, 'ndvi.tif')
+
+        create_dummy_band(shape, path=b4_path, data=red)
+        create_dummy_band(shape, path=b5_path, data=nir)
+
+        compute_ndvi(b4_path, b5_path, out_path, dtype="float32")
+
+        with rasterio.open(out_path) as src:
+            ndvi = src.read(1)
+            mean_tag = float(src.tags()['MEAN_NDVI'])
+
+    ##old per-pixel formula on scaled reflectance
+    r = red.astype('float64') * SR_SCALE + SR_OFFSET
+    n = nir.astype('float64') * SR_SCALE + SR_OFFSET
+    expected = np.clip((n - r) / (n + r + NDVI_EPS), -1, 1)
+    fill = (red == 0) | (nir == 0)
+
+    assert np.all(ndvi[fill] == -9999)
+    np.testing.assert_allclose(ndvi[~fill], expected[~fill], atol=1e-5)
+    assert abs(mean_tag - expected[~fill].mean()) < 1e-5